@@ -0,0 +1,68 @@
+"""
+Benchmark the cold start time of the modules & scripts.
+
+Each case runs in a fresh interpreter so nothing is cached between runs.
+The eager case imports youtube_dl and podgen up front, which is what every
+import of feed.py used to cost.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+CASES = [
+    ("python (empty)", ["-c", "pass"]),
+    ("import meta", ["-c", "import meta"]),
+    ("import cache", ["-c", "import cache"]),
+    ("import feed", ["-c", "import feed"]),
+    ("feed.py --help", ["feed.py", "--help"]),
+    ("import web", ["-c", "import web"]),
+    ("eager youtube_dl + podgen", ["-c", "import feed, youtube_dl, podgen"]),
+]
+
+
+def time_case(args, runs):
+    """
+    Run python with args runs times.
+
+    Returns: List of wall clock times in milliseconds, None if the command failed.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable] + args, cwd=ROOT,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+        if proc.returncode:
+            return None
+
+    return times
+
+
+def create_parser():
+    """
+    Generate a simple command line parser.
+    """
+    parser = argparse.ArgumentParser(description='Benchmark cold start time.')
+    parser.add_argument('-n', '--runs', type=int, default=10, help='Runs of each case.')
+
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+
+    print("{:28} {:>10} {:>10}".format("Case", "Min ms", "Median ms"))
+    for name, case_args in CASES:
+        times = time_case(case_args, args.runs)
+        if times:
+            print("{:28} {:10.1f} {:10.1f}".format(name, min(times), statistics.median(times)))
+        else:
+            print("{:28} {:>21}".format(name, "unavailable"))
+
+
+if __name__ == "__main__":
+    main()
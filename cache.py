@@ -0,0 +1,483 @@
+"""
+Manage the local media cache that web.py streams videos from.
+
+Downloads reserve their expected size before they start so that a burst of
+cold requests cannot push the cache past MAX_CACHE or fill the disk.
+
+Audio only requests are remuxed locally with ffmpeg from a cached video of the
+same id when one exists, instead of downloading the audio again.
+
+Eviction is windowed LFU: files requested least often within the last WINDOW
+requests go first, ties broken by oldest access. The newest episodes of each
+series are pinned, PIN_LATEST unless the series settings set pin_latest.
+Pinned files are only evicted once they use more than PIN_SHARE of the cache.
+"""
+import asyncio
+import collections
+import os
+import pathlib
+import shutil
+import subprocess
+
+import meta
+
+MEDIA = pathlib.Path("web/media")
+MAX_CACHE = 2 * 1024 ** 3  # Total video cache, prunes least popular
+MIN_FREE = 512 * 1024 ** 2  # Always leave this much free on the filesystem
+DEFAULT_SIZE = 256 * 1024 ** 2  # Assumed size when info JSON has no filesize
+ADMIT_TIMEOUT = 300  # Seconds a download may wait in queue for space
+WINDOW = 1000  # Number of recent requests used to count popularity
+PIN_LATEST = 1  # Newest episodes of each series that are pinned by default
+PIN_SHARE = 0.5  # Most of max_bytes pinned files may hold before they can be evicted
+AUDIO_SOURCES = {"140": ("22", "18")}  # Audio format -> video formats carrying the same AAC
+EXTRACT_TIMEOUT = 300  # Seconds ffmpeg may take to remux an audio track
+
+
+class CacheFull(Exception):
+    """
+    The requested download cannot fit in the cache.
+    """
+
+
+class DownloadFailed(Exception):
+    """
+    The video could not be downloaded or extracted into the cache.
+    """
+
+
+def expected_size(info, format_id):
+    """
+    Find the expected size of the download for format_id from the info JSON.
+
+    Falls back to the top level filesize, then to DEFAULT_SIZE.
+    """
+    for fmt in info.get("formats", []):
+        if fmt["format_id"] == format_id and fmt.get("filesize"):
+            return fmt["filesize"]
+
+    return info.get("filesize") or DEFAULT_SIZE
+
+
+def file_size(fname):
+    """
+    Returns: The size of fname in bytes, 0 if it no longer exists.
+    """
+    try:
+        return os.stat(str(fname)).st_size
+    except OSError:
+        return 0
+
+
+def media_name(vid_id, format_id):
+    """
+    Returns: The file name a video is cached under for a given format.
+    """
+    return "{}.{}.mp4".format(vid_id, format_id)
+
+
+def video_id(fname):
+    """
+    Returns: The youtube id a cached media file was stored under.
+    """
+    return pathlib.Path(fname).name.split(".")[0]
+
+
+def series_infos(folder):
+    """
+    Read the info JSON of every episode of a series in folder.
+
+    Returns: List of info dictionaries, oldest episode first.
+    """
+    infos = [meta.read_json_info(str(x)) for x in pathlib.Path(folder).glob("*.info.json")]
+
+    return sorted(infos, key=lambda x: (x.get("upload_date", ""), x.get("playlist_index") or 0))
+
+
+def latest_infos(folder, count):
+    """
+    Returns: The info dictionaries of the count newest episodes in folder.
+    """
+    return series_infos(folder)[-count:] if count > 0 else []
+
+
+def latest_ids(folder, count):
+    """
+    Find the newest episodes of a series from the info JSON in folder.
+
+    Returns: Set of the youtube ids of the count newest episodes.
+    """
+    return {x["id"] for x in latest_infos(folder, count)}
+
+
+def extract_audio(source, dest):
+    """
+    Remux the AAC track of a cached video into an audio only mp4 with ffmpeg.
+    The track is copied, not reencoded. Output is written to a .part file first
+    so a partial file is never served.
+
+    Returns: True if dest was created, False if ffmpeg is missing or failed.
+    """
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return False
+
+    part = str(dest) + ".part"
+    cmd = [ffmpeg, "-v", "error", "-y", "-i", str(source),
+           "-map", "0:a:0", "-c:a", "copy", "-f", "mp4", part]
+    try:
+        subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, timeout=EXTRACT_TIMEOUT)
+        os.rename(part, str(dest))
+        return True
+    except (OSError, subprocess.SubprocessError):
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        return False
+
+
+class WarmUp():
+    """
+    Progress of pre downloading episodes of a series into the cache.
+
+    Attributes:
+        series - The short name of the series.
+        format_id - The format being downloaded.
+        pending - Ids of the episodes still to download.
+        done - Ids of the episodes now in the cache.
+        failed - Ids of the episodes that could not be downloaded.
+        current - Id of the episode downloading now, None otherwise.
+        infos - Map of id -> info dictionary of every episode ever queued.
+    """
+    def __init__(self, series, format_id, infos):
+        self.series = series
+        self.format_id = format_id
+        self.pending = []
+        self.done = []
+        self.failed = []
+        self.current = None
+        self.infos = {}
+        self.add(infos)
+
+    def add(self, infos):
+        """
+        Queue the episodes in infos, skipping those already queued by this warm up.
+        Episodes may be added while the warm up runs.
+
+        Returns: List of the ids newly queued.
+        """
+        added = [x["id"] for x in infos if x["id"] not in self.infos]
+        self.infos.update({x["id"]: x for x in infos if x["id"] in added})
+        self.pending += added
+
+        return added
+
+    @property
+    def finished(self):
+        """
+        True once every episode has been attempted.
+        """
+        return not self.pending and not self.current
+
+    def to_dict(self):
+        """
+        Returns: The progress as a JSON serializable dictionary.
+        """
+        return {
+            "series": self.series,
+            "format_id": self.format_id,
+            "pending": self.pending,
+            "done": self.done,
+            "failed": self.failed,
+            "current": self.current,
+            "finished": self.finished,
+        }
+
+
+class MediaCache():
+    """
+    Track the files in the media folder and the space reserved by in flight downloads.
+
+    Attributes:
+        root - The folder holding the cached media.
+        max_bytes - The most bytes the cache may hold, including reservations.
+        min_free - The bytes that must always remain free on the filesystem.
+        reserved - Map of file name -> bytes reserved for downloads in progress.
+        requests - The file names of the last WINDOW requests, counts popularity.
+        busy - Names of cached files being read to extract audio, never evicted.
+        pins - Youtube ids of the pinned episodes as of the last refresh_pins, None before.
+    """
+    def __init__(self, root=MEDIA, max_bytes=MAX_CACHE, min_free=MIN_FREE):
+        self.root = pathlib.Path(root)
+        self.max_bytes = max_bytes
+        self.min_free = min_free
+        self.reserved = {}
+        self.requests = collections.deque(maxlen=WINDOW)
+        self.pins = None
+        self._pins = {}
+        self.busy = set()
+        self._cond = None
+
+    @property
+    def cond(self):
+        """
+        Condition notified each time a reservation is released.
+        Created lazily so it binds to the loop of the running server.
+        """
+        if not self._cond:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def files(self):
+        """
+        Returns: List of completed media files in the cache.
+        """
+        return [x for x in self.root.glob("*.mp4") if x.name not in self.reserved]
+
+    def usage(self):
+        """
+        Returns: Bytes used by cached files plus bytes reserved by downloads.
+        """
+        return sum(file_size(x) for x in self.files()) + sum(self.reserved.values())
+
+    def free_space(self):
+        """
+        Returns: Bytes free on the filesystem less the bytes still to be written by downloads.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        return shutil.disk_usage(str(self.root)).free - sum(self.reserved.values())
+
+    def fits(self, size, freed=0):
+        """
+        Returns: True if size more bytes fit under both the cache and filesystem limits,
+                 once freed bytes of cached files have been evicted.
+        """
+        under_max = self.usage() - freed + size <= self.max_bytes
+        return under_max and self.free_space() + freed - size >= self.min_free
+
+    def touch(self, fname):
+        """
+        Record a request for fname.
+        """
+        self.requests.append(pathlib.Path(fname).name)
+
+    def refresh_pins(self):
+        """
+        Find the ids of the newest episodes of every series and store them in pins.
+        The number pinned is pin_latest from the series settings, else PIN_LATEST.
+        The settings and info JSON are only reread when the series folder or settings change.
+        This reads the disk, the server runs it in an executor before taking the admission lock.
+
+        Returns: Set of youtube ids that must not be evicted.
+        """
+        old_pins, new_pins, ids = self._pins, {}, set()
+        folders = [x for x in self.root.iterdir() if x.is_dir()] if self.root.is_dir() else []
+
+        for folder in folders:
+            settings = folder / meta.SETTINGS
+            key = (os.stat(str(folder)).st_mtime,
+                   os.stat(str(settings)).st_mtime if settings.exists() else 0)
+            if folder.name in old_pins and old_pins[folder.name][0] == key:
+                new_pins[folder.name] = old_pins[folder.name]
+            else:
+                count = meta.read_series_settings(folder).get("pin_latest", PIN_LATEST)
+                new_pins[folder.name] = (key, latest_ids(folder, count))
+            ids |= new_pins[folder.name][1]
+
+        self._pins = new_pins
+        self.pins = ids
+        return ids
+
+    def evict_order(self, keep=()):
+        """
+        Order the cached files for eviction, least requested in window first then oldest access.
+        Pinned files come last, and only those beyond PIN_SHARE of max_bytes are included.
+        Files in busy or named in keep are never included.
+        Uses the pins of the last refresh_pins, only refreshing them if never done.
+
+        Returns: List of the files that may be evicted, first to evict first.
+        """
+        counts = collections.Counter(self.requests)
+        pins = self.pins if self.pins is not None else self.refresh_pins()
+
+        def rank(fname):
+            try:
+                return (counts[fname.name], os.stat(str(fname)).st_atime)
+            except OSError:
+                return (counts[fname.name], 0)
+
+        fnames = sorted([x for x in self.files() if x.name not in self.busy and x.name not in keep],
+                        key=rank)
+        unpinned = [x for x in fnames if video_id(x) not in pins]
+        pinned = [x for x in reversed(fnames) if video_id(x) in pins]
+
+        kept, overflow = 0, []
+        for fname in pinned:
+            kept += file_size(fname)
+            if kept > self.max_bytes * PIN_SHARE:
+                overflow.insert(0, fname)
+
+        return unpinned + overflow
+
+    def make_room(self, size, keep=()):
+        """
+        Evict cached files until size more bytes fit, never the files named in keep.
+        Nothing is evicted unless evicting every candidate would make enough room.
+        The eviction order is only computed when size does not already fit.
+
+        Returns: True if the space is now available.
+        """
+        if self.fits(size):
+            return True
+
+        victims = self.evict_order(keep)
+        if not self.fits(size, sum(file_size(x) for x in victims)):
+            return False
+
+        while not self.fits(size) and victims:
+            try:
+                os.remove(victims.pop(0))
+            except OSError:
+                pass
+
+        return self.fits(size)
+
+    def trim(self, keep=()):
+        """
+        Enforce max_bytes after a download, expected sizes are only estimates.
+        The files named in keep are never evicted.
+        """
+        self.make_room(0, keep)
+
+    def try_reserve(self, fname, size):
+        """
+        Reserve size bytes for fname, evicting ahead of time if needed.
+        A file already cached needs no reservation, it is admitted without evicting.
+
+        Returns: True if fname is cached or the reservation was made, False if it must wait.
+        Raises: CacheFull if the download can never fit, or it does not fit now and
+                no download is in flight that could free space.
+        """
+        if fname in self.reserved:
+            return False
+        if (self.root / fname).exists():
+            return True
+        if size > self.max_bytes:
+            raise CacheFull("{} needs {} bytes, cache holds {}".format(fname, size, self.max_bytes))
+
+        if not self.make_room(size):
+            if not self.reserved:
+                raise CacheFull("No room for {} bytes for {}".format(size, fname))
+            return False
+
+        self.reserved[fname] = size
+        return True
+
+    def release(self, fname):
+        """
+        Drop the reservation for fname.
+        """
+        self.reserved.pop(fname, None)
+
+    async def reserve(self, fname, size, timeout=ADMIT_TIMEOUT):
+        """
+        Wait in queue until size bytes can be reserved for fname.
+        Only one download of a given fname is admitted at a time, a cached fname
+        is admitted once any download of it finishes and is not reserved.
+
+        Raises: CacheFull if no space freed up before timeout.
+        """
+        async with self.cond:
+            try:
+                await asyncio.wait_for(self.cond.wait_for(lambda: self.try_reserve(fname, size)),
+                                       timeout)
+            except asyncio.TimeoutError:
+                raise CacheFull("Timed out waiting for {} bytes for {}".format(size, fname))
+
+    async def finish(self, fname):
+        """
+        Release the reservation for fname, trim the cache and wake queued downloads.
+        The trim never evicts fname, it is about to be served.
+        """
+        async with self.cond:
+            self.release(fname)
+            self.trim(keep=(fname,))
+            self.cond.notify_all()
+
+    def audio_source(self, vid_id, format_id):
+        """
+        Find a cached video of vid_id whose audio track can serve format_id.
+
+        Returns: The path to the cached video, None if no usable source.
+        """
+        for source_id in AUDIO_SOURCES.get(format_id, ()):
+            source = self.root / media_name(vid_id, source_id)
+            if source.name not in self.reserved and source.exists():
+                return source
+
+        return None
+
+    async def fetch(self, info, format_id, download):
+        """
+        Ensure the video described by info is cached in format_id.
+        Audio is extracted from a cached video when possible, otherwise
+        download(url, format_id) is called. Space is reserved first and the work
+        runs in an executor so queued requests keep the server responsive.
+
+        Returns: The path to the cached file.
+        Raises:
+            CacheFull - The video could not be admitted.
+            DownloadFailed - The download finished without creating the file.
+        """
+        fname = media_name(info["id"], format_id)
+        loop = asyncio.get_event_loop()
+        if not (self.root / fname).exists():
+            await loop.run_in_executor(None, self.refresh_pins)
+
+        source = self.audio_source(info["id"], format_id)
+        if source:
+            self.busy.add(source.name)
+
+        try:
+            await self.reserve(fname, expected_size(info, format_id))
+            if fname in self.reserved:
+                try:
+                    dest = self.root / fname
+                    extracted = source and await loop.run_in_executor(
+                        None, extract_audio, source, dest)
+                    if not extracted:
+                        await loop.run_in_executor(None, download, info["webpage_url"], format_id)
+                finally:
+                    await self.finish(fname)
+        finally:
+            if source:
+                self.busy.discard(source.name)
+
+        if not (self.root / fname).exists():
+            raise DownloadFailed("Could not download {} for {}".format(fname, info["webpage_url"]))
+
+        return self.root / fname
+
+    async def warm_up(self, progress, download):
+        """
+        Download each pending episode of progress into the cache one at a time,
+        until none remain. Episodes added to progress while running are included.
+        Each episode counts as one request, so warmed files are not the first evicted.
+        An episode that fails for any reason is recorded in progress.failed.
+
+        Args:
+            progress - A WarmUp updated as each episode completes.
+            download - Called as download(url, format_id) to fetch a video.
+        """
+        while progress.pending:
+            progress.current = progress.pending.pop(0)
+            info = progress.infos[progress.current]
+            self.touch(media_name(info["id"], progress.format_id))
+            try:
+                await self.fetch(info, progress.format_id, download)
+                progress.done.append(info["id"])
+            except Exception:  # pylint: disable=broad-except
+                progress.failed.append(info["id"])
+            finally:
+                progress.current = None
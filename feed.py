@@ -1,5 +1,8 @@
 """
 Script to convert & create the podgen RSS to be served.
+
+podgen, youtube_dl and urllib are slow to import, they are only loaded
+by the functions that need them so --help and importing this module stay fast.
 """
 import argparse
 import datetime
@@ -8,15 +11,10 @@ import json
 import os
 import sys
 
-import podgen
-import youtube_dl
+import meta
 
 SUMMARY_LEN = 250
-FORMATS = {
-    "audio": "140",
-    "medium": "18",
-    "high": "22",
-}
+SERVER = "http://localhost:8000"  # The running web.py, warm ups are done by it
 
 
 def youtube_download(url, opts_update=None, playlist=None):
@@ -41,7 +39,7 @@ def youtube_download(url, opts_update=None, playlist=None):
         "progress_hooks": [ydl_hook],
     }
     """
-    output_template = "web/media/%(id)s.mp4"
+    output_template = "web/media/%(id)s.%(format_id)s.mp4"
     if playlist:
         output_template = "web/media/{}/%(playlist_index)s - %(title)s.mp4".format(playlist)
 
@@ -53,6 +51,8 @@ def youtube_download(url, opts_update=None, playlist=None):
 
     if opts_update:
         ydl_opts.update(opts_update)
+
+    import youtube_dl
     with youtube_dl.YoutubeDL(ydl_opts) as ydl:
         ydl.download([url])
 
@@ -70,7 +70,7 @@ def fetch_video(url, format_id):
     youtube_download(url, opts_update=opts_update)
 
 
-def fetch_playlist_info(url, folder, format_id=FORMATS["medium"]):
+def fetch_playlist_info(url, folder, format_id=meta.FORMATS["medium"]):
     opts_update = {
         "format": format_id,
         "skip_download": True,
@@ -79,76 +79,18 @@ def fetch_playlist_info(url, folder, format_id=FORMATS["medium"]):
     youtube_download(url, opts_update=opts_update, playlist=folder)
 
 
-def read_json_info(fname):
-    """
-    Parse info from the video information file.
-
-    Returns: Dictionary containing information on podcast episode.
-    """
-    with open(fname) as fin:
-        return json.load(fin)
-
-
-def prune_playlist_info(fnames):
-    """
-    Prune the playlist metadata to ONLY the required information.
-    """
-    for fname in fnames:
-        info = read_json_info(fname)
-
-        keep_keys = ["id", "upload_date", "title", "uploader", "thumbnail",
-                     "description", "duration", "webpage_url", "formats", "format_id",
-                     "playlist", "playlist_index", "filesize", "format", "fulltitle"]
-        for key in set(info.keys()) - set(keep_keys):
-            del info[key]
-
-        for fmt_val in info["formats"][:]:
-            if fmt_val["format_id"] not in FORMATS.values():
-                info["formats"].remove(fmt_val)
-
-        with open(fname, 'w') as fout:
-            json.dump(info, fout, separators=(',', ':'))
-
-
-def parse_date_string(date_str, timezone_offset=0):
-    """
-    Take a string of form yyyymmdd and an offset from UTC and
-    return a datetime.datetime object representing that time.
-    """
-    year = int(date_str[:4])
-    month = int(date_str[4:6])
-    day = int(date_str[6:])
-
-    return datetime.datetime(year=year, month=month, day=day,
-                             tzinfo=datetime.timezone(datetime.timedelta(hours=timezone_offset)))
-
-
-def shorten_to_len(text, max_len):
-    """
-    Take a text of arbitrary length and split on new lines.
-    Keep adding whole lines until max_len is reached or surpassed.
-
-    Returns the new shorter text.
-    """
-    shorter_text = ''
-    text_parts = text.split("\n")
-
-    while text_parts and len(shorter_text) < max_len:
-        shorter_text += text_parts[0] + "\n"
-        text_parts = text_parts[1:]
-
-    return shorter_text.rstrip()
-
-
 def create_episodes(fnames, series_name, format_id):
+    import podgen
+
     episodes = []
 
     for fname in fnames:
-        info = read_json_info(fname)
+        info = meta.read_json_info(fname)
         fmt_info = [x for x in info["formats"] if x['format_id'] == format_id][0]
 
         media = podgen.Media(
-            url="http://starcraftman.com/video/{}/{}.mp4".format(series_name, info["playlist_index"]),
+            url="http://starcraftman.com/video/{}/{}.mp4?format={}".format(
+                series_name, info["playlist_index"], format_id),
             duration=datetime.timedelta(seconds=int(info["duration"])),
             size=fmt_info["filesize"],
             type="video/mp4",
@@ -156,9 +98,9 @@ def create_episodes(fnames, series_name, format_id):
         episode = podgen.Episode(
             title=info["title"],
             image=info["thumbnail"],
-            summary=shorten_to_len(info["description"], SUMMARY_LEN),
+            summary=meta.shorten_to_len(info["description"], SUMMARY_LEN),
             long_summary=info["description"],
-            publication_date=parse_date_string(info["upload_date"]),
+            publication_date=meta.parse_date_string(info["upload_date"]),
             media=media,
         )
         episodes.append(episode)
@@ -170,6 +112,8 @@ def create_podcast(episodes, series_name, title=None, description=None, persons=
     """
     Create a podcast based on the episodes & required information.
     """
+    import podgen
+
     episode = episodes[0]
     if not title:
         title = episode.title
@@ -188,6 +132,61 @@ def create_podcast(episodes, series_name, title=None, description=None, persons=
     return pod
 
 
+def new_episode_ids(info_files, old_files):
+    """
+    Returns: Set of the youtube ids of the info files not in old_files.
+    """
+    return {meta.read_json_info(x)["id"] for x in set(info_files) - set(old_files)}
+
+
+def warm_url(server, series_name, fmt):
+    """
+    Returns: The url of the warm up route of the server for a series and format name.
+    """
+    import urllib.parse
+
+    return "{}/warm/{}/{}".format(server, urllib.parse.quote(series_name), fmt)
+
+
+def warm_cache(series_name, fmt, latest, ids=None, server=SERVER):
+    """
+    Ask the server to pre download the newest episodes of a series in the background,
+    so the first requests are served from cache. The server does the downloads so
+    they share its cache reservations.
+
+    Args:
+        series_name - The short name of the series (storage).
+        fmt - The name of the format, a key of meta.FORMATS.
+        latest - Only consider the latest episodes of the series.
+        ids - If set, only warm episodes with these youtube ids.
+        server - The base url of the running web.py.
+
+    Returns: Dictionary of the warm up progress reported by the server.
+    Raises: OSError if the server could not be reached.
+    """
+    import urllib.parse
+    import urllib.request
+
+    query = {"latest": latest}
+    if ids is not None:
+        query["ids"] = ",".join(sorted(ids))
+    url = warm_url(server, series_name, fmt) + "?" + urllib.parse.urlencode(query)
+
+    with urllib.request.urlopen(urllib.request.Request(url, method="POST")) as resp:
+        return json.loads(resp.read().decode())
+
+
+def warm_progress(series_name, fmt, server=SERVER):
+    """
+    Returns: Dictionary of the progress of the last warm up the server started.
+    Raises: OSError if the server could not be reached.
+    """
+    import urllib.request
+
+    with urllib.request.urlopen(warm_url(server, series_name, fmt)) as resp:
+        return json.loads(resp.read().decode())
+
+
 def create_parser():
     """
     Generate a simple command line parser.
@@ -200,21 +199,34 @@ def create_parser():
         Select audio, medium or high for format_id.
 {prog} URL series_name format_id --title A title --description A description for podcast
         Same as above, manually override the title and description of the podcast.
+{prog} URL series_name format_id --pin 2
+        Same as above, from now on keep the latest 2 episodes of the series in the cache.
+{prog} URL series_name format_id --warm 3
+        Same as above, then have the server at --server download any new episodes
+        among the latest 3 into the cache in the background.
     """.format(prog=prog)
 
     parser = argparse.ArgumentParser(prog=prog, description=desc,
                                      formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('url', help='The youtube playlist.')
     parser.add_argument('series_name', help='The short name of the series (storage).')
-    parser.add_argument('format', choices=FORMATS.keys(), help='The format to fetch.')
+    parser.add_argument('format', choices=meta.FORMATS.keys(), help='The format to fetch.')
     parser.add_argument('-t', '--title', nargs='+', default=None, help='The title of the podcast.')
     parser.add_argument('-d', '--description', nargs='+', default=None, help='The short description of podcast.')
+    parser.add_argument('-p', '--pin', type=int, default=None,
+                        help='Keep the latest PIN episodes in the cache, saved with the series.')
+    parser.add_argument('-w', '--warm', type=int, default=0,
+                        help='Have the server download new episodes among the latest WARM.')
+    parser.add_argument('-s', '--server', default=SERVER,
+                        help='The base url of the running web.py, used by --warm.')
 
     return parser
 
 
 def main():
     args = create_parser().parse_args()
+    import podgen
+
     if args.title:
         args.title = " ".join(args.title)
     if args.description:
@@ -225,13 +237,17 @@ def main():
     except OSError:
         pass
 
+    info_glob = "web/media/{}/*.info.json*".format(args.series_name)
+    old_files = set(glob.glob(info_glob))
     fetch_playlist_info(args.url, args.series_name)
+    if args.pin is not None:
+        meta.write_series_settings("web/media/{}".format(args.series_name), pin_latest=args.pin)
 
-    info_files = sorted(glob.glob("web/media/{}/*.info.json*".format(args.series_name)))
-    prune_playlist_info(info_files)
-    episodes = create_episodes(info_files, args.series_name, FORMATS[args.format])
+    info_files = sorted(glob.glob(info_glob))
+    meta.prune_playlist_info(info_files)
+    episodes = create_episodes(info_files, args.series_name, meta.FORMATS[args.format])
 
-    info = read_json_info(info_files[0])
+    info = meta.read_json_info(info_files[0])
     persons = [podgen.Person(info['uploader'], 'N/A')]
     pod = create_podcast(episodes, args.series_name, title=args.title,
                          description=args.description, persons=persons)
@@ -240,6 +256,15 @@ def main():
     pod.rss_file(fname)
     print('RSS file written to: ' + fname)
 
+    new_ids = new_episode_ids(info_files, old_files) if args.warm else set()
+    if new_ids:
+        try:
+            progress = warm_cache(args.series_name, args.format, args.warm,
+                                  ids=new_ids, server=args.server)
+            print('Warm up queued, pending: ' + ', '.join(progress['pending']))
+        except OSError as exc:
+            print('Could not start warm up on {}: {}'.format(args.server, exc))
+
 
 if __name__ == "__main__":
     main()
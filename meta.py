@@ -0,0 +1,101 @@
+"""
+Light weight core for reading & pruning the youtube_dl video metadata.
+
+Only depends on the standard library, so web.py and cache.py can read
+the info JSON without loading youtube_dl or podgen.
+"""
+import datetime
+import json
+import os
+
+FORMATS = {
+    "audio": "140",
+    "medium": "18",
+    "high": "22",
+}
+SETTINGS = "settings.json"  # Per series settings, stored next to the info JSON
+
+
+def read_json_info(fname):
+    """
+    Parse info from the video information file.
+
+    Returns: Dictionary containing information on podcast episode.
+    """
+    with open(fname) as fin:
+        return json.load(fin)
+
+
+def read_series_settings(folder):
+    """
+    Read the settings stored with a series in folder.
+
+    Returns: Dictionary of settings, empty if none were saved.
+    """
+    try:
+        return read_json_info(os.path.join(str(folder), SETTINGS))
+    except (OSError, ValueError):
+        return {}
+
+
+def write_series_settings(folder, **settings):
+    """
+    Update the settings stored with a series in folder with the keyword arguments.
+    """
+    current = read_series_settings(folder)
+    current.update(settings)
+
+    os.makedirs(str(folder), exist_ok=True)
+    with open(os.path.join(str(folder), SETTINGS), 'w') as fout:
+        json.dump(current, fout)
+
+
+def prune_playlist_info(fnames):
+    """
+    Prune the playlist metadata to ONLY the required information.
+    """
+    for fname in fnames:
+        info = read_json_info(fname)
+
+        keep_keys = ["id", "upload_date", "title", "uploader", "thumbnail",
+                     "description", "duration", "webpage_url", "formats", "format_id",
+                     "playlist", "playlist_index", "filesize", "format", "fulltitle"]
+        for key in set(info.keys()) - set(keep_keys):
+            del info[key]
+
+        for fmt_val in info["formats"][:]:
+            if fmt_val["format_id"] not in FORMATS.values():
+                info["formats"].remove(fmt_val)
+
+        with open(fname, 'w') as fout:
+            json.dump(info, fout, separators=(',', ':'))
+
+
+def parse_date_string(date_str, timezone_offset=0):
+    """
+    Take a string of form yyyymmdd and an offset from UTC and
+    return a datetime.datetime object representing that time.
+    """
+    year = int(date_str[:4])
+    month = int(date_str[4:6])
+    day = int(date_str[6:])
+
+    return datetime.datetime(year=year, month=month, day=day,
+                             tzinfo=datetime.timezone(datetime.timedelta(hours=timezone_offset)))
+
+
+def shorten_to_len(text, max_len):
+    """
+    Take a text of arbitrary length and split on new lines.
+    Keep adding whole lines until max_len is reached or surpassed.
+
+    Returns the new shorter text.
+    """
+    shorter_text = ''
+    text_parts = text.split("\n")
+
+    while text_parts and len(shorter_text) < max_len:
+        shorter_text += text_parts[0] + "\n"
+        text_parts = text_parts[1:]
+
+    return shorter_text.rstrip()
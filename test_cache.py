@@ -0,0 +1,372 @@
+"""
+Test cache.py
+"""
+import asyncio
+import json
+import os
+
+import pytest
+
+import cache
+
+
+def write_file(path, size, atime=None):
+    with open(str(path), 'wb') as fout:
+        fout.write(b'0' * size)
+    if atime:
+        os.utime(str(path), (atime, atime))
+
+
+def test_expected_size():
+    info = {
+        "filesize": 50,
+        "formats": [
+            {"format_id": "140", "filesize": 10},
+            {"format_id": "18", "filesize": None},
+        ],
+    }
+
+    assert cache.expected_size(info, "140") == 10
+    assert cache.expected_size(info, "18") == 50
+    assert cache.expected_size({}, "22") == cache.DEFAULT_SIZE
+
+
+def test_make_room_evicts_oldest(tmp_path):
+    write_file(tmp_path / 'old.mp4', 400, atime=1000)
+    write_file(tmp_path / 'new.mp4', 400, atime=2000)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+
+    assert media.make_room(500)
+    assert not (tmp_path / 'old.mp4').exists()
+    assert (tmp_path / 'new.mp4').exists()
+
+
+def test_make_room_evicts_nothing_when_short(tmp_path):
+    write_file(tmp_path / 'old.mp4', 400, atime=1000)
+    write_file(tmp_path / 'new.mp4', 400, atime=2000)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    media.busy.add('new.mp4')
+
+    assert not media.make_room(700)
+    assert (tmp_path / 'old.mp4').exists()
+    assert (tmp_path / 'new.mp4').exists()
+
+
+def test_try_reserve_counts_reservations(tmp_path):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+
+    assert media.try_reserve('a.mp4', 600)
+    assert not media.try_reserve('b.mp4', 600)
+    assert not media.try_reserve('a.mp4', 10)
+    media.release('a.mp4')
+    assert media.try_reserve('b.mp4', 600)
+
+
+def test_try_reserve_cached(tmp_path):
+    write_file(tmp_path / 'vid.18.mp4', 10, atime=1000)
+    write_file(tmp_path / 'other.18.mp4', 10, atime=2000)
+    media = cache.MediaCache(tmp_path, max_bytes=5, min_free=1024 ** 6)
+
+    assert media.try_reserve('vid.18.mp4', 10)
+    assert not media.reserved
+    assert (tmp_path / 'other.18.mp4').exists()
+
+
+def test_fetch_cached_skips_admission(tmp_path):
+    write_file(tmp_path / 'vid.18.mp4', 10)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=1024 ** 6)
+
+    def download(url, format_id):
+        raise AssertionError('Should not download ' + url)
+
+    info = {'id': 'vid', 'webpage_url': 'vid', 'filesize': 10}
+    fname = asyncio.new_event_loop().run_until_complete(media.fetch(info, '18', download))
+
+    assert fname == tmp_path / 'vid.18.mp4'
+    assert not media.reserved
+
+
+def test_fetch_keeps_file_larger_than_expected(tmp_path):
+    write_file(tmp_path / 'hot.18.mp4', 500)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    for _ in range(5):
+        media.touch('hot.18.mp4')
+
+    def download(url, format_id):
+        write_file(tmp_path / cache.media_name(url, format_id), 700)
+
+    info = {'id': 'new', 'webpage_url': 'new', 'filesize': 100}
+    fname = asyncio.new_event_loop().run_until_complete(media.fetch(info, '18', download))
+
+    assert fname.exists()
+    assert not (tmp_path / 'hot.18.mp4').exists()
+
+
+def test_fetch_download_failed(tmp_path):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    info = {'id': 'vid', 'webpage_url': 'vid', 'filesize': 10}
+
+    with pytest.raises(cache.DownloadFailed):
+        asyncio.new_event_loop().run_until_complete(
+            media.fetch(info, '18', lambda url, format_id: None))
+    assert not media.reserved
+
+
+def test_try_reserve_too_large(tmp_path):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+
+    with pytest.raises(cache.CacheFull):
+        media.try_reserve('a.mp4', 1001)
+
+
+def test_try_reserve_disk_full(tmp_path):
+    write_file(tmp_path / 'old.mp4', 10)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=1024 ** 6)
+
+    with pytest.raises(cache.CacheFull):
+        media.try_reserve('a.mp4', 10)
+    assert (tmp_path / 'old.mp4').exists()
+
+    media.reserved['b.mp4'] = 0
+    assert not media.try_reserve('a.mp4', 10)
+    assert (tmp_path / 'old.mp4').exists()
+
+
+def test_reserve_queues_until_finish(tmp_path):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+
+    async def run():
+        await media.reserve('a.mp4', 600)
+        waiter = asyncio.ensure_future(media.reserve('b.mp4', 600, timeout=5))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        await media.finish('a.mp4')
+        await waiter
+        assert 'b.mp4' in media.reserved
+
+        with pytest.raises(cache.CacheFull):
+            await media.reserve('c.mp4', 600, timeout=0.01)
+
+    asyncio.new_event_loop().run_until_complete(run())
+
+
+def test_evict_order_popular_last(tmp_path):
+    write_file(tmp_path / 'hot.mp4', 10, atime=1000)
+    write_file(tmp_path / 'cold.mp4', 10, atime=3000)
+    write_file(tmp_path / 'binge.mp4', 10, atime=2000)
+    media = cache.MediaCache(tmp_path)
+    for _ in range(3):
+        media.touch('hot.mp4')
+    media.touch('binge.mp4')
+
+    assert [x.name for x in media.evict_order()] == ['cold.mp4', 'binge.mp4', 'hot.mp4']
+
+
+def test_evict_order_skips_pinned(tmp_path):
+    series = tmp_path / 'series'
+    series.mkdir()
+    for ind, vid_id in enumerate(['first', 'second', 'third'], 1):
+        with open(str(series / '{} - ep.info.json'.format(ind)), 'w') as fout:
+            json.dump({'id': vid_id, 'upload_date': '2019010{}'.format(ind),
+                       'playlist_index': ind}, fout)
+        write_file(tmp_path / '{}.mp4'.format(vid_id), 10, atime=1000 * ind)
+    media = cache.MediaCache(tmp_path)
+
+    assert [x.name for x in media.evict_order()] == ['first.mp4', 'second.mp4']
+    cache.meta.write_series_settings(series, pin_latest=2)
+    assert [x.name for x in media.evict_order()] == ['first.mp4', 'second.mp4']
+    media.refresh_pins()
+    assert [x.name for x in media.evict_order()] == ['first.mp4']
+
+
+def test_evict_order_caps_pinned(tmp_path):
+    series = tmp_path / 'series'
+    series.mkdir()
+    for ind, vid_id in enumerate(['first', 'second', 'third'], 1):
+        with open(str(series / '{} - ep.info.json'.format(ind)), 'w') as fout:
+            json.dump({'id': vid_id, 'upload_date': '2019010{}'.format(ind),
+                       'playlist_index': ind}, fout)
+        write_file(tmp_path / '{}.mp4'.format(vid_id), 300, atime=1000 * ind)
+    cache.meta.write_series_settings(series, pin_latest=3)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    media.touch('third.mp4')
+
+    assert [x.name for x in media.evict_order()] == ['first.mp4', 'second.mp4']
+
+
+def test_warm_up(tmp_path):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    infos = [
+        {'id': 'small', 'webpage_url': 'small', 'filesize': 100},
+        {'id': 'huge', 'webpage_url': 'huge', 'filesize': 2000},
+    ]
+    progress = cache.WarmUp('series', '18', infos)
+
+    def download(url, format_id):
+        write_file(tmp_path / cache.media_name(url, format_id), 100)
+
+    asyncio.new_event_loop().run_until_complete(media.warm_up(progress, download))
+
+    assert progress.done == ['small']
+    assert progress.failed == ['huge']
+    assert progress.finished
+    assert (tmp_path / 'small.18.mp4').exists()
+
+
+def test_audio_source(tmp_path):
+    media = cache.MediaCache(tmp_path)
+    assert media.audio_source('vid', '140') is None
+
+    write_file(tmp_path / 'vid.18.mp4', 10)
+    assert media.audio_source('vid', '140') == tmp_path / 'vid.18.mp4'
+    write_file(tmp_path / 'vid.22.mp4', 10)
+    assert media.audio_source('vid', '140') == tmp_path / 'vid.22.mp4'
+    assert media.audio_source('vid', '18') is None
+
+
+def test_extract_audio_no_ffmpeg(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache.shutil, 'which', lambda _: None)
+
+    assert not cache.extract_audio(tmp_path / 'vid.22.mp4', tmp_path / 'vid.140.mp4')
+
+
+def test_fetch_extracts_audio_locally(tmp_path, monkeypatch):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    write_file(tmp_path / 'vid.22.mp4', 900)
+    extracted = []
+
+    def extract_audio(source, dest):
+        assert source.name in media.busy
+        extracted.append(source.name)
+        write_file(dest, 50)
+        return True
+
+    def download(url, format_id):
+        raise AssertionError('Should not download ' + url)
+
+    monkeypatch.setattr(cache, 'extract_audio', extract_audio)
+    info = {'id': 'vid', 'webpage_url': 'vid', 'filesize': 50}
+    fname = asyncio.new_event_loop().run_until_complete(media.fetch(info, '140', download))
+
+    assert fname == tmp_path / 'vid.140.mp4'
+    assert extracted == ['vid.22.mp4']
+    assert (tmp_path / 'vid.22.mp4').exists()
+    assert not media.busy
+
+
+def test_warm_up_survives_errors(tmp_path):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    infos = [
+        {'id': 'a', 'webpage_url': 'a', 'filesize': 100},
+        {'id': 'b', 'webpage_url': 'b', 'filesize': 100},
+    ]
+    progress = cache.WarmUp('series', '18', infos)
+
+    def download(url, format_id):
+        if url == 'a':
+            raise OSError('Disk error')
+        write_file(tmp_path / cache.media_name(url, format_id), 100)
+
+    asyncio.new_event_loop().run_until_complete(media.warm_up(progress, download))
+
+    assert progress.to_dict() == {
+        'series': 'series',
+        'format_id': '18',
+        'pending': [],
+        'done': ['b'],
+        'failed': ['a'],
+        'current': None,
+        'finished': True,
+    }
+
+
+def test_warm_up_not_evicted_first(tmp_path):
+    for ind in range(3):
+        fname = 'old{}.18.mp4'.format(ind)
+        write_file(tmp_path / fname, 10, atime=1000 + ind)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    for ind in range(3):
+        media.touch('old{}.18.mp4'.format(ind))
+    progress = cache.WarmUp('series', '18', [{'id': 'new1', 'webpage_url': 'new1', 'filesize': 10}])
+
+    def download(url, format_id):
+        write_file(tmp_path / cache.media_name(url, format_id), 10)
+
+    asyncio.new_event_loop().run_until_complete(media.warm_up(progress, download))
+
+    assert media.evict_order()[-1].name == 'new1.18.mp4'
+
+
+def test_fetch_downloads_when_extract_fails(tmp_path, monkeypatch):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    write_file(tmp_path / 'vid.18.mp4', 100)
+    downloaded = []
+
+    def download(url, format_id):
+        downloaded.append((url, format_id))
+        write_file(tmp_path / cache.media_name(url, format_id), 50)
+
+    monkeypatch.setattr(cache, 'extract_audio', lambda source, dest: False)
+    info = {'id': 'vid', 'webpage_url': 'vid', 'filesize': 50}
+    fname = asyncio.new_event_loop().run_until_complete(media.fetch(info, '140', download))
+
+    assert downloaded == [('vid', '140')]
+    assert fname.exists()
+    assert not media.busy
+
+
+def test_busy_source_not_evicted(tmp_path, monkeypatch):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    write_file(tmp_path / 'vid.22.mp4', 500, atime=1000)
+    write_file(tmp_path / 'other.18.mp4', 300, atime=2000)
+    seen = []
+
+    def extract_audio(source, dest):
+        seen.append([x.name for x in media.evict_order()])
+        write_file(dest, 400)
+        return True
+
+    monkeypatch.setattr(cache, 'extract_audio', extract_audio)
+    info = {'id': 'vid', 'webpage_url': 'vid', 'filesize': 200}
+    asyncio.new_event_loop().run_until_complete(media.fetch(info, '140', None))
+
+    assert seen == [['other.18.mp4']]
+    assert (tmp_path / 'vid.22.mp4').exists()
+    assert not (tmp_path / 'other.18.mp4').exists()
+
+
+def test_pins_only_read_when_changed(tmp_path, monkeypatch):
+    series = tmp_path / 'series'
+    series.mkdir()
+    with open(str(series / '1 - ep.info.json'), 'w') as fout:
+        json.dump({'id': 'first', 'upload_date': '20190101', 'playlist_index': 1}, fout)
+    write_file(tmp_path / 'first.18.mp4', 600)
+    write_file(tmp_path / 'other.18.mp4', 300)
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    assert media.refresh_pins() == {'first'}
+
+    def latest_ids(folder, count):
+        raise AssertionError('Should not reread ' + str(folder))
+
+    monkeypatch.setattr(cache, 'latest_ids', latest_ids)
+    assert media.make_room(100)
+    assert media.refresh_pins() == {'first'}
+    assert media.make_room(400)
+    assert [x.name for x in tmp_path.glob('*.mp4')] == ['first.18.mp4']
+
+
+def test_warm_up_add_while_running(tmp_path):
+    media = cache.MediaCache(tmp_path, max_bytes=1000, min_free=0)
+    progress = cache.WarmUp('series', '18', [{'id': 'a', 'webpage_url': 'a', 'filesize': 10}])
+
+    def download(url, format_id):
+        if url == 'a':
+            assert progress.add([{'id': 'a', 'webpage_url': 'a', 'filesize': 10},
+                                 {'id': 'b', 'webpage_url': 'b', 'filesize': 10}]) == ['b']
+        write_file(tmp_path / cache.media_name(url, format_id), 10)
+
+    asyncio.new_event_loop().run_until_complete(media.warm_up(progress, download))
+
+    assert progress.done == ['a', 'b']
+    assert progress.finished
@@ -0,0 +1,126 @@
+"""
+Test web.py
+"""
+import json
+
+import pytest
+import sanic.exceptions
+
+import cache
+import web
+
+
+class FakeRequest():
+    """
+    Stand in for a sanic request, only carries the query arguments.
+    """
+    def __init__(self, **args):
+        self.args = args
+
+
+@pytest.fixture
+def warm_env(tmp_path, monkeypatch):
+    """
+    Point the server at a cache in tmp_path holding a series of 3 episodes.
+    Background tasks are collected instead of run.
+    """
+    series = tmp_path / 'series'
+    series.mkdir()
+    for ind, vid_id in enumerate(['first', 'second', 'third'], 1):
+        with open(str(series / '{} - ep.info.json'.format(ind)), 'w') as fout:
+            json.dump({'id': vid_id, 'upload_date': '2019010{}'.format(ind),
+                       'playlist_index': ind}, fout)
+
+    tasks = []
+
+    def add_task(coro):
+        coro.close()
+        tasks.append(coro)
+
+    monkeypatch.setattr(web, 'CACHE', cache.MediaCache(tmp_path))
+    monkeypatch.setattr(web, 'WARM_UPS', {})
+    monkeypatch.setattr(web.app, 'add_task', add_task)
+
+    return tasks
+
+
+def run(route, *args):
+    """
+    Call the handler behind a route directly, newer sanic returns it with its routes.
+    """
+    handler = route[-1] if isinstance(route, tuple) else route
+    return cache.asyncio.new_event_loop().run_until_complete(handler(*args))
+
+
+def test_post_warm(warm_env):
+    resp = run(web.post_warm, FakeRequest(latest='2'), 'series', 'medium')
+
+    assert resp.status == 202
+    assert json.loads(resp.body.decode())['pending'] == ['second', 'third']
+    assert len(warm_env) == 1
+
+
+def test_post_warm_ids(warm_env):
+    resp = run(web.post_warm, FakeRequest(latest='3', ids='first,third'), 'series', 'audio')
+
+    assert json.loads(resp.body.decode())['pending'] == ['first', 'third']
+    assert web.WARM_UPS[('series', 'audio')].format_id == '140'
+
+
+def test_post_warm_running(warm_env):
+    run(web.post_warm, FakeRequest(latest='1'), 'series', 'medium')
+    resp = run(web.post_warm, FakeRequest(latest='3', ids='first,third'), 'series', 'medium')
+
+    assert json.loads(resp.body.decode())['pending'] == ['third', 'first']
+    assert len(warm_env) == 1
+
+
+def test_post_warm_finished(warm_env):
+    run(web.post_warm, FakeRequest(latest='1'), 'series', 'medium')
+    web.WARM_UPS[('series', 'medium')].pending.clear()
+    resp = run(web.post_warm, FakeRequest(latest='2'), 'series', 'medium')
+
+    assert json.loads(resp.body.decode())['pending'] == ['second', 'third']
+    assert len(warm_env) == 2
+
+
+@pytest.mark.parametrize('latest', ['abc', '-1', '2.5'])
+def test_post_warm_bad_latest(warm_env, latest):
+    with pytest.raises(sanic.exceptions.InvalidUsage) as exc:
+        run(web.post_warm, FakeRequest(latest=latest), 'series', 'medium')
+
+    assert exc.value.status_code == 400
+    assert not warm_env
+
+
+def test_post_warm_bad_format(warm_env):
+    with pytest.raises(sanic.exceptions.NotFound):
+        run(web.post_warm, FakeRequest(), 'series', 'ultra')
+
+
+def test_get_warm(warm_env):
+    with pytest.raises(sanic.exceptions.NotFound):
+        run(web.get_warm, FakeRequest(), 'series', 'medium')
+
+    run(web.post_warm, FakeRequest(latest='1'), 'series', 'medium')
+    resp = run(web.get_warm, FakeRequest(), 'series', 'medium')
+
+    assert resp.status == 200
+    info = json.loads(resp.body.decode())
+    assert info['pending'] == ['third']
+    assert not info['finished']
+
+
+def test_get_video_download_failed(tmp_path, monkeypatch):
+    series = tmp_path / 'web' / 'media' / 'series'
+    series.mkdir(parents=True)
+    with open(str(series / '1 - ep.info.json'), 'w') as fout:
+        json.dump({'id': 'vid', 'format_id': '18', 'webpage_url': 'vid', 'filesize': 10}, fout)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(web, 'CACHE', cache.MediaCache(series.parent, min_free=0))
+    monkeypatch.setattr(web.feed, 'fetch_video', lambda url, format_id: None)
+
+    with pytest.raises(sanic.exceptions.SanicException) as exc:
+        run(web.get_video, FakeRequest(), 'series', '1')
+
+    assert exc.value.status_code == 502
@@ -0,0 +1,63 @@
+"""
+Script to have the server pre download the newest episodes of a series into the media cache.
+"""
+import argparse
+import sys
+import time
+
+import feed
+import meta
+
+POLL_SECONDS = 5  # Time between progress reports while waiting
+
+
+def create_parser():
+    """
+    Generate a simple command line parser.
+    """
+    prog = 'python ./' + sys.argv[0]
+    desc = """Have the server download the latest episodes of a series into its cache.
+
+{prog} series_name format_id
+        Download the latest episode of series_name in format_id, report progress until done.
+{prog} series_name format_id --latest 5 --no-wait
+        Start downloading the latest 5 episodes of series_name in format_id and exit.
+    """.format(prog=prog)
+
+    parser = argparse.ArgumentParser(prog=prog, description=desc,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('series_name', help='The short name of the series (storage).')
+    parser.add_argument('format', choices=meta.FORMATS.keys(), help='The format to fetch.')
+    parser.add_argument('-l', '--latest', type=int, default=1,
+                        help='The number of newest episodes to download.')
+    parser.add_argument('-s', '--server', default=feed.SERVER,
+                        help='The base url of the running web.py.')
+    parser.add_argument('--no-wait', action='store_true',
+                        help='Exit once the warm up is started.')
+
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+
+    try:
+        progress = feed.warm_cache(args.series_name, args.format, args.latest, server=args.server)
+        while not args.no_wait and not progress['finished']:
+            print('Warm up {}: {} done, {} failed, {} pending'.format(
+                args.series_name, len(progress['done']), len(progress['failed']),
+                len(progress['pending'])))
+            time.sleep(POLL_SECONDS)
+            progress = feed.warm_progress(args.series_name, args.format, server=args.server)
+    except OSError as exc:
+        print('Could not reach server {}: {}'.format(args.server, exc))
+        sys.exit(1)
+
+    print('Warm up {}: {} done, {} failed'.format(
+        args.series_name, len(progress['done']), len(progress['failed'])))
+    if progress['failed']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
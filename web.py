@@ -1,17 +1,21 @@
 """
 Sanic webserver to serve the podcasts on demand.
 """
-import os
 import pathlib
 
 import sanic
+import sanic.exceptions
 import sanic.response
 
-import vid
+import cache
+import feed
+import meta
 
 app = sanic.Sanic()
 app.config.RESPONSE_TIMEOUT = 600  # Downloading takes long
-MAX_CACHE = 2 * 1024 ** 3  # Total video cache, prunes oldest
+CACHE = cache.MediaCache()
+WARM_LATEST = 3  # Default episodes considered by a warm up
+WARM_UPS = {}  # (series, format) -> cache.WarmUp of the last warm up started
 
 
 @app.route("/rss/<series>.rss")
@@ -19,32 +23,75 @@ async def get_rss(_, series):
     return await sanic.response.file('web/rss/{}.rss'.format(series))
 
 
-def remove_old_vids(fnames):
-    fnames = list(reversed(sorted(fnames, key=lambda fname: os.stat(fname).st_atime)))
-    total_bytes = 0
-    for fname in fnames:
-        total_bytes += os.stat(fname).st_size
-
-    while total_bytes > MAX_CACHE:
-        total_bytes -= os.stat(fnames[0]).st_size
-        os.remove(fnames[0])
-        del fnames[0]
-
-
 @app.route("/video/<series>/<episode>.mp4")
-async def get_video(_, series, episode):
+async def get_video(request, series, episode):
+    """
+    Stream an episode, downloading it first if not cached.
+    The format query argument selects the format id, defaults to that of the info JSON.
+    """
     episode = int(episode) - 1
     media = pathlib.Path("web/media")
 
     info_files = media.glob("{}/*.info.json".format(series))
     info_file = sorted(info_files)[episode]
-    info = vid.read_json_info(info_file)
-    vid.fetch_video(info["webpage_url"], info["format_id"])
-
-    remove_old_vids(list(media.glob('*.mp4')))
-
-    vids = list(media.glob('{}.mp4'.format(info['id'])))
-    return await sanic.response.file_stream(vids[0])
+    info = meta.read_json_info(info_file)
+    format_id = request.args.get("format", info["format_id"])
+    if format_id not in meta.FORMATS.values():
+        raise sanic.exceptions.NotFound("Unknown format: " + format_id)
+    CACHE.touch(cache.media_name(info["id"], format_id))
+
+    try:
+        fname = await CACHE.fetch(info, format_id, feed.fetch_video)
+    except cache.CacheFull as exc:
+        raise sanic.exceptions.ServiceUnavailable(str(exc))
+    except cache.DownloadFailed as exc:
+        raise sanic.exceptions.SanicException(str(exc), status_code=502)
+
+    return await sanic.response.file_stream(fname)
+
+
+@app.route("/warm/<series>/<fmt>", methods=["POST"])
+async def post_warm(request, series, fmt):
+    """
+    Start downloading the latest episodes of series in the background.
+    Set the number of episodes with the latest query argument and optionally
+    restrict them to a comma separated list of youtube ids with the ids argument.
+    If a warm up of series is already running, new episodes are added to it.
+    """
+    if fmt not in meta.FORMATS:
+        raise sanic.exceptions.NotFound("Unknown format: " + fmt)
+    try:
+        latest = int(request.args.get("latest", WARM_LATEST))
+    except ValueError:
+        latest = -1
+    if latest < 0:
+        raise sanic.exceptions.InvalidUsage("latest must be a non negative integer")
+
+    infos = cache.latest_infos(CACHE.root / series, latest)
+    if request.args.get("ids") is not None:
+        ids = set(request.args.get("ids").split(","))
+        infos = [x for x in infos if x["id"] in ids]
+
+    progress = WARM_UPS.get((series, fmt))
+    if progress and not progress.finished:
+        progress.add(infos)
+    else:
+        progress = cache.WarmUp(series, meta.FORMATS[fmt], infos)
+        WARM_UPS[(series, fmt)] = progress
+        app.add_task(CACHE.warm_up(progress, feed.fetch_video))
+
+    return sanic.response.json(progress.to_dict(), status=202)
+
+
+@app.route("/warm/<series>/<fmt>")
+async def get_warm(_, series, fmt):
+    """
+    Report the progress of the last warm up of series.
+    """
+    try:
+        return sanic.response.json(WARM_UPS[(series, fmt)].to_dict())
+    except KeyError:
+        raise sanic.exceptions.NotFound("No warm up for {} {}".format(series, fmt))
 
 
 def main():